@@ -1,13 +1,137 @@
+import os
+import torch
 from sentence_transformers import SentenceTransformer
 import numpy as np
+import hashlib
+import queue
+import threading
+from collections import OrderedDict
 from datetime import datetime
 import sys
 from pathlib import Path
 
+# Configure PyTorch CPU threading before any model is loaded
+# (container defaults are often 1 thread; override with TORCH_NUM_THREADS)
+_n_threads = int(os.getenv("TORCH_NUM_THREADS", os.cpu_count() or 4))
+torch.set_num_threads(_n_threads)
+try:
+    torch.set_num_interop_threads(max(1, _n_threads // 2))
+except RuntimeError:
+    # Can only be set once, before any inter-op work has started
+    pass
+
 # Add parent directory to path to import supabase_client
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
-from supabase_client import SupabaseManager
+from supabase_client import get_supabase_manager
+
+# Exported + int8-quantized MiniLM (see export_onnx.py)
+ONNX_MODEL_DIR = Path(__file__).parent / "onnx_minilm"
+ONNX_MODEL_FILE = "model_quantized.onnx"
+
+# Minimum cosine similarity between int8 and FP32 embeddings to keep quantization
+QUANTIZATION_MIN_COSINE = 0.99
+
+# Chunks shorter than this (page numbers, stray headers) are not embedded
+MIN_CHUNK_CHARS = 40
+
+# Chunks per embed/upload batch and max batches in flight between pipeline stages
+PIPELINE_BATCH_SIZE = 32
+PIPELINE_QUEUE_SIZE = 4
+
+# Max number of query embeddings kept in the per-process LRU cache
+EMBEDDING_CACHE_SIZE = 1024
+
+# Default B2B SaaS examples if no brand data available
+_DEFAULT_EXAMPLES = (
+    """Are you still manually pulling data from 5 different tools?
+
+We talked to 200+ startup founders. 73% said they lose 6+ hours per week just gathering basic metrics.
+
+Here's what changed:
+→ One dashboard. All your data.
+→ Zero SQL required.
+→ Insights in minutes, not days.
+
+Try it free for 14 days.""",
+
+    """Question for founders: When was the last time you made a product decision based on data vs. a hunch?
+
+Teams that track retention weekly grow 2.3x faster.
+
+You don't need a data team. You need the right tool.""",
+
+    """Real talk: Most analytics tools were built for enterprises with data teams.
+
+You're a startup. You need something that works today.
+
+✅ Connect in 5 minutes
+✅ Pre-built dashboards
+✅ Plain English insights"""
+)
+
+
+class OnnxEmbedder:
+    """
+    ONNX Runtime replacement for SentenceTransformer('all-MiniLM-L6-v2')
+    Exposes the same encode() signature so BrandRAG can use either backend
+    """
+    
+    def __init__(self, model_dir: Path = ONNX_MODEL_DIR):
+        """Load tokenizer and cache the ORT inference session"""
+        from optimum.onnxruntime import ORTModelForFeatureExtraction
+        from transformers import AutoTokenizer
+        
+        self.tokenizer = AutoTokenizer.from_pretrained(model_dir)
+        self.session = ORTModelForFeatureExtraction.from_pretrained(
+            model_dir,
+            file_name=ONNX_MODEL_FILE,
+            provider="CPUExecutionProvider"
+        )
+    
+    def encode(
+        self,
+        texts: list,
+        batch_size: int = 32,
+        show_progress_bar: bool = False,
+        convert_to_numpy: bool = True,
+        normalize_embeddings: bool = True
+    ) -> np.ndarray:
+        """Tokenize, run the ORT session and mean-pool the last hidden state"""
+        # Batch texts of similar length together to minimize padding,
+        # as SentenceTransformer.encode does internally
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        sorted_texts = [texts[i] for i in order]
+        batches = []
+        
+        for start in range(0, len(sorted_texts), batch_size):
+            inputs = self.tokenizer(
+                sorted_texts[start:start + batch_size],
+                padding=True,
+                truncation=True,
+                max_length=256,
+                return_tensors="np"
+            )
+            hidden = self.session(**inputs).last_hidden_state
+            
+            # Mean pooling over non-padding tokens
+            mask = inputs["attention_mask"][..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            
+            if normalize_embeddings:
+                pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            
+            batches.append(pooled)
+        
+        if not batches:
+            return np.empty((0, 384), dtype=np.float32)
+        
+        # Restore the caller's order
+        embeddings = np.vstack(batches)
+        out = np.empty_like(embeddings)
+        out[order] = embeddings
+        return out
+
 
 class BrandRAG:
     """
@@ -18,26 +142,40 @@ class BrandRAG:
     def __init__(self):
         """Initialize RAG system with Supabase and sentence-transformers"""
         
+        # LRU cache of query embeddings keyed by SHA256 of the text
+        self._emb_cache: OrderedDict = OrderedDict()
+        # BrandRAG is shared across Streamlit sessions (threads)
+        self._emb_cache_lock = threading.Lock()
+        
         # Initialize sentence transformer for embeddings
         self.device = 'cpu'  # Force CPU for Mac compatibility
         
-        print("📄 Loading sentence transformer model...")
-        try:
-            # Load model with explicit CPU device (all-MiniLM-L6-v2 = 384 dimensions)
-            self.embedder = SentenceTransformer('all-MiniLM-L6-v2', device=self.device)
-            print("✅ Sentence transformer loaded successfully (384-dim embeddings)")
-        except Exception as e:
-            print(f"❌ Failed to load embeddings model: {e}")
-            self.embedder = None
+        # Prefer the quantized ONNX model when it has been exported
+        self.embedder = None
+        if (ONNX_MODEL_DIR / ONNX_MODEL_FILE).exists():
+            print("📄 Loading ONNX Runtime model...")
+            try:
+                self.embedder = OnnxEmbedder()
+                print("✅ ONNX Runtime model loaded successfully (384-dim embeddings)")
+            except Exception as e:
+                print(f"⚠️ ONNX Runtime unavailable, falling back to PyTorch: {e}")
+        
+        if self.embedder is None:
+            self._load_sentence_transformer()
         
-        # Initialize Supabase client
+        self.connect_db()
+    
+    def connect_db(self):
+        """Connect to Supabase; safe to call again to retry a failed connection"""
         print("🔌 Connecting to Supabase...")
         try:
-            self.db = SupabaseManager()
-            if self.db.is_connected():
+            # Assign only once connected: other sessions may be using self.db
+            db = get_supabase_manager()
+            if db.is_connected():
+                self.db = db
                 print("✅ Supabase connected successfully")
                 # Test knowledge count
-                count = self.db.count_knowledge_chunks(org_id=None)
+                count = self.db.count_knowledge_chunks_fast(org_id=None)
                 print(f"📚 Platform knowledge chunks available: {count}")
             else:
                 print("⚠️ Supabase connection failed")
@@ -46,19 +184,164 @@ class BrandRAG:
             print(f"❌ Supabase initialization failed: {e}")
             self.db = None
     
-    def create_embedding(self, text: str):
-        """Create 384-dim embedding for text using sentence-transformers"""
-        if self.embedder is None:
-            # Fallback: return random embedding (for testing only)
-            print("⚠️ Using random embedding fallback")
-            return np.random.rand(384).tolist()
+    def _load_sentence_transformer(self):
+        """Load the PyTorch sentence transformer model"""
+        print("📄 Loading sentence transformer model...")
+        try:
+            # Load model with explicit CPU device (all-MiniLM-L6-v2 = 384 dimensions)
+            self.embedder = SentenceTransformer('all-MiniLM-L6-v2', device=self.device)
+            print("✅ Sentence transformer loaded successfully (384-dim embeddings)")
+        except Exception as e:
+            print(f"❌ Failed to load embeddings model: {e}")
+            self.embedder = None
+            return
+        
+        self._quantize_sentence_transformer()
+    
+    def _quantize_sentence_transformer(self):
+        """
+        Apply int8 dynamic quantization to the transformer's Linear layers
+        Kept only if embeddings on the default examples stay within QUANTIZATION_MIN_COSINE
+        """
+        module = self.embedder[0]
+        fp32_model = module.auto_model
         
         try:
-            embedding = self.embedder.encode(text, convert_to_numpy=True)
-            return embedding.tolist()
+            probe = list(_DEFAULT_EXAMPLES)
+            reference = self.embedder.encode(probe, convert_to_numpy=True, normalize_embeddings=True)
+            
+            module.auto_model = torch.quantization.quantize_dynamic(
+                fp32_model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+            
+            quantized = self.embedder.encode(probe, convert_to_numpy=True, normalize_embeddings=True)
+            min_cosine = float((reference * quantized).sum(axis=1).min())
+            
+            if min_cosine < QUANTIZATION_MIN_COSINE:
+                module.auto_model = fp32_model
+                print(f"⚠️ int8 quantization too lossy (cosine {min_cosine:.4f}), keeping FP32")
+            else:
+                print(f"✅ int8 dynamic quantization applied (cosine {min_cosine:.4f})")
         except Exception as e:
-            print(f"⚠️ Embedding creation failed: {e}")
-            return np.random.rand(384).tolist()
+            # e.g. no quantized engine on arm64; never leave a broken model installed
+            module.auto_model = fp32_model
+            print(f"⚠️ int8 quantization skipped: {e}")
+    
+    def create_embedding(self, text: str):
+        """Create 384-dim embedding for text, served from the LRU cache when possible"""
+        key = hashlib.sha256(text.encode()).digest()
+        
+        with self._emb_cache_lock:
+            cached = self._emb_cache.get(key)
+            if cached is not None:
+                self._emb_cache.move_to_end(key)
+                return cached
+        
+        # Encode outside the lock so concurrent queries don't serialize on it
+        embedding = self.create_embeddings([text])[0].tolist()
+        
+        with self._emb_cache_lock:
+            self._emb_cache[key] = embedding
+            if len(self._emb_cache) > EMBEDDING_CACHE_SIZE:
+                self._emb_cache.popitem(last=False)
+        
+        return embedding
+    
+    def create_embeddings(self, texts: list) -> np.ndarray:
+        """
+        Create 384-dim unit-norm embeddings for a batch of texts in one encode call
+        Raises instead of returning placeholder vectors so nothing bogus is stored
+        """
+        if self.embedder is None:
+            raise RuntimeError("Embeddings model not loaded")
+        
+        # Unit-norm vectors let pgvector rank by inner product (see migrations/004)
+        return self.embedder.encode(
+            texts,
+            batch_size=32,
+            show_progress_bar=False,
+            convert_to_numpy=True,
+            normalize_embeddings=True
+        )
+    
+    def _filter_new_chunks(self, brand_id: str, examples: list, seen: set) -> tuple:
+        """
+        Drop short chunks, duplicates within the upload (tracked in seen)
+        and chunks already stored for brand_id; returns (examples, content hashes)
+        """
+        kept, hashes = [], []
+        for example in examples:
+            content_hash = hashlib.sha1(example.encode()).hexdigest()
+            if len(example) >= MIN_CHUNK_CHARS and content_hash not in seen:
+                seen.add(content_hash)
+                kept.append(example)
+                hashes.append(content_hash)
+        
+        # Skip chunks already stored by a previous upload of the same doc
+        existing = self.db.existing_content_hashes(brand_id, hashes)
+        if existing:
+            pairs = [(e, h) for e, h in zip(kept, hashes) if h not in existing]
+            kept, hashes = [e for e, _ in pairs], [h for _, h in pairs]
+        
+        return kept, hashes
+    
+    def _build_rows(
+        self, 
+        brand_id: str, 
+        examples: list, 
+        hashes: list, 
+        embeddings: np.ndarray, 
+        content_type: str,
+        source: str,
+        start_index: int = 0
+    ) -> list:
+        """Build knowledge_docs rows for a batch of examples and their embeddings"""
+        return [
+            {
+                'content': example,
+                'embedding': embeddings[idx].tolist(),
+                'org_id': brand_id,
+                'metadata': {
+                    'content_type': content_type,
+                    'length': len(example),
+                    'source': source,
+                    'chunk_index': start_index + idx,
+                    'content_hash': hashes[idx]
+                }
+            }
+            for idx, example in enumerate(examples)
+        ]
+    
+    def _store_rows(self, rows: list) -> int:
+        """Bulk-insert rows, falling back to per-row inserts; returns rows stored"""
+        # Store all chunks in one Supabase round trip
+        result = self.db.store_knowledge_chunks_bulk(rows)
+        if result['success']:
+            return len(rows)
+        
+        print(f"⚠️ Bulk insert failed ({result.get('error')}), retrying per chunk")
+        success_count = 0
+        
+        for row in rows:
+            metadata = dict(row['metadata'])
+            source = metadata.pop('source')
+            chunk_index = metadata.pop('chunk_index')
+            
+            result = self.db.store_knowledge_chunk(
+                content=row['content'],
+                embedding=row['embedding'],
+                org_id=row['org_id'],
+                source=source,
+                chunk_index=chunk_index,
+                metadata=metadata
+            )
+            
+            if result['success']:
+                success_count += 1
+            else:
+                print(f"⚠️ Failed to store chunk {chunk_index}: {result.get('error')}")
+        
+        return success_count
     
     def store_brand_examples(
         self, 
@@ -73,37 +356,122 @@ class BrandRAG:
             return False
         
         try:
-            success_count = 0
+            new_examples, hashes = self._filter_new_chunks(brand_id, examples, set())
+            if not new_examples:
+                print(f"✅ No new examples to store ({len(examples)} skipped)")
+                return True
             
-            for idx, example in enumerate(examples):
-                # Create embedding
-                embedding = self.create_embedding(example)
-                
-                # Store in Supabase
-                result = self.db.store_knowledge_chunk(
-                    content=example,
-                    embedding=embedding,
-                    org_id=brand_id,
-                    source=source,
-                    chunk_index=idx,
-                    metadata={
-                        'content_type': content_type,
-                        'length': len(example)
-                    }
-                )
-                
-                if result['success']:
-                    success_count += 1
-                else:
-                    print(f"⚠️ Failed to store chunk {idx}: {result.get('error')}")
+            # Create all embeddings in one batched encode call
+            embeddings = self.create_embeddings(new_examples)
+            rows = self._build_rows(brand_id, new_examples, hashes, embeddings, content_type, source)
             
-            print(f"✅ Stored {success_count}/{len(examples)} examples")
-            return success_count == len(examples)
+            success_count = self._store_rows(rows)
+            print(f"✅ Stored {success_count}/{len(new_examples)} examples ({len(examples) - len(new_examples)} skipped)")
+            return success_count == len(new_examples)
             
         except Exception as e:
             print(f"❌ Error storing examples: {e}")
             return False
     
+    def store_brand_stream(
+        self, 
+        brand_id: str, 
+        chunks, 
+        content_type: str = 'example_post',
+        source: str = 'manual_upload'
+    ) -> int:
+        """
+        Pipelined store for chunks produced incrementally (e.g. page by page)
+        Chunk production, embedding and upload run concurrently; returns chunks stored
+        (0 if every chunk was skipped) and raises if any stage fails
+        """
+        if not self.db or not self.db.is_connected():
+            raise RuntimeError("Supabase not available")
+        
+        # Bounded queues give backpressure between the stages; None ends a stage
+        chunk_batches = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        row_batches = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        stop = threading.Event()
+        errors = []
+        
+        def produce():
+            batch = []
+            try:
+                for chunk in chunks:
+                    if stop.is_set():
+                        return
+                    batch.append(chunk)
+                    if len(batch) == PIPELINE_BATCH_SIZE:
+                        chunk_batches.put(batch)
+                        batch = []
+                if batch:
+                    chunk_batches.put(batch)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                chunk_batches.put(None)
+        
+        def embed():
+            chunk_index = 0
+            seen = set()
+            try:
+                while (batch := chunk_batches.get()) is not None:
+                    if stop.is_set():
+                        # Upload failed; just drain so the producer can finish
+                        continue
+                    
+                    batch, hashes = self._filter_new_chunks(brand_id, batch, seen)
+                    if not batch:
+                        continue
+                    
+                    embeddings = self.create_embeddings(batch)
+                    row_batches.put(self._build_rows(
+                        brand_id, batch, hashes, embeddings, content_type, source, chunk_index
+                    ))
+                    chunk_index += len(batch)
+            except Exception as e:
+                errors.append(e)
+                stop.set()
+                # Unblock the producer so it can see the stop flag
+                while chunk_batches.get() is not None:
+                    pass
+            finally:
+                row_batches.put(None)
+        
+        producer = threading.Thread(target=produce, daemon=True)
+        embedder = threading.Thread(target=embed, daemon=True)
+        producer.start()
+        embedder.start()
+        
+        # Upload in the calling thread
+        stored = 0
+        submitted = 0
+        try:
+            while (rows := row_batches.get()) is not None:
+                submitted += len(rows)
+                stored += self._store_rows(rows)
+        except Exception as e:
+            errors.append(e)
+            stop.set()
+            # Unblock the embedder so both workers can exit
+            while row_batches.get() is not None:
+                pass
+        
+        producer.join()
+        embedder.join()
+        
+        if errors:
+            print(f"❌ Error storing examples: {errors[0]}")
+            raise RuntimeError(
+                f"Stored {stored} chunks from {source} before failing: {errors[0]}"
+            ) from errors[0]
+        
+        if stored < submitted:
+            raise RuntimeError(f"Stored only {stored}/{submitted} chunks from {source}")
+        
+        print(f"✅ Stored {stored} chunks from {source}")
+        return stored
+    
     def retrieve_brand_context(
         self, 
         brand_id: str, 
@@ -120,30 +488,18 @@ class BrandRAG:
             # Create query embedding
             query_embedding = self.create_embedding(query)
             
-            results = []
-            
-            # Search brand-specific knowledge
-            if brand_id:
-                brand_results = self.db.semantic_search(
-                    query_embedding=query_embedding,
-                    org_id=brand_id,
-                    limit=top_k,
-                    threshold=0.5
-                )
-                results.extend(brand_results)
-                print(f"📚 Found {len(brand_results)} brand-specific results")
+            # Brand-specific knowledge first, platform knowledge fills the rest
+            results = self.db.semantic_search_two_scope(
+                query_embedding=query_embedding,
+                org_id=brand_id,
+                limit=top_k,
+                threshold=0.5,
+                include_platform=include_platform
+            )
             
-            # Also search platform knowledge if requested
-            if include_platform and len(results) < top_k:
-                remaining = top_k - len(results)
-                platform_results = self.db.semantic_search(
-                    query_embedding=query_embedding,
-                    org_id=None,
-                    limit=remaining,
-                    threshold=0.5
-                )
-                results.extend(platform_results)
-                print(f"📚 Found {len(platform_results)} platform knowledge results")
+            brand_count = sum(1 for r in results if r.get('scope') == 'brand')
+            print(f"📚 Found {brand_count} brand-specific results")
+            print(f"📚 Found {len(results) - brand_count} platform knowledge results")
             
             if results:
                 # Extract content from results
@@ -160,32 +516,7 @@ class BrandRAG:
     
     def _get_default_examples(self):
         """Default B2B SaaS examples if no brand data available"""
-        return [
-            """Are you still manually pulling data from 5 different tools?
-
-We talked to 200+ startup founders. 73% said they lose 6+ hours per week just gathering basic metrics.
-
-Here's what changed:
-→ One dashboard. All your data.
-→ Zero SQL required.
-→ Insights in minutes, not days.
-
-Try it free for 14 days.""",
-
-            """Question for founders: When was the last time you made a product decision based on data vs. a hunch?
-
-Teams that track retention weekly grow 2.3x faster.
-
-You don't need a data team. You need the right tool.""",
-
-            """Real talk: Most analytics tools were built for enterprises with data teams.
-
-You're a startup. You need something that works today.
-
-✅ Connect in 5 minutes
-✅ Pre-built dashboards
-✅ Plain English insights"""
-        ]
+        return list(_DEFAULT_EXAMPLES)
     
     def get_stats(self, org_id: str = None):
         """Get RAG system statistics"""
@@ -197,14 +528,15 @@ You're a startup. You need something that works today.
             }
         
         try:
-            chunk_count = self.db.count_knowledge_chunks(org_id=org_id)
+            chunk_count = self.db.count_knowledge_chunks_fast(org_id=org_id)
             
             return {
                 'connected': True,
                 'chunks': chunk_count,
                 'embedder_loaded': self.embedder is not None,
                 'embedding_dim': 384,
-                'model': 'all-MiniLM-L6-v2'
+                'model': 'all-MiniLM-L6-v2',
+                'backend': 'onnxruntime' if isinstance(self.embedder, OnnxEmbedder) else 'pytorch'
             }
         except Exception as e:
             print(f"❌ Failed to get stats: {e}")
@@ -2,7 +2,9 @@
 
 import google.generativeai as genai
 import os
-import json
+import re
+import orjson
+from types import MappingProxyType
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -10,6 +12,62 @@ load_dotenv()
 # Configure Gemini
 genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
 
+# Markdown code fence in a model response (``` or ~~~, optional json tag, prose allowed around it)
+_FENCE = re.compile(r'(```|~~~)(?:json)?\s*(.*?)\s*\1', re.DOTALL | re.IGNORECASE)
+
+# Opening fence with no closing fence (e.g. a truncated response)
+_OPEN_FENCE = re.compile(r'^(```|~~~)(?:json)?\s*', re.IGNORECASE)
+
+
+def _parse_json_response(text: str):
+    """Parse model JSON, stripping a markdown fence only if the bare text isn't valid JSON"""
+    try:
+        return orjson.loads(text)
+    except orjson.JSONDecodeError:
+        pass
+    
+    # Only fall back to fences here: they can legitimately appear inside JSON strings
+    m = _FENCE.search(text)
+    if m:
+        return orjson.loads(m.group(2))
+    return orjson.loads(_OPEN_FENCE.sub('', text))
+
+# Platform best practices injected into strategy prompts (read-only)
+_PLATFORM_KNOWLEDGE = MappingProxyType({
+    'linkedin': """
+LinkedIn Best Practices:
+- B2B focus, professional tone essential
+- Carousel ads: 2x engagement vs single image
+- Targeting: Job titles, company size, industry
+- Lead gen forms reduce friction
+- Optimal times: Tue-Thu, 9-11am
+- Image specs: 1200x627px (1.91:1 ratio)
+- Character limits: Headline 70, Body 150
+- Typical CTR: 0.5-1.0%, CPC: $5-15, CPL: $50-150
+    """,
+    'meta': """
+Meta (Facebook/Instagram) Best Practices:
+- Stories and Reels: highest engagement
+- Interest-based + lookalike targeting
+- Retargeting essential for conversions
+- Image ratio: 1:1 or 4:5 for feed, 9:16 for stories
+- Character limits: Headline 40, Body 125
+- Typical CTR: 0.9-2.5%, CPC: $0.50-3.00
+- Test multiple ad variations
+    """,
+    'tiktok': """
+TikTok Best Practices:
+- Short vertical video (15-30 sec)
+- Authentic, raw content beats polished
+- Hook in first 3 seconds critical
+- 9:16 aspect ratio required
+- Gen Z and Millennial audience
+- Typical CTR: 1.5-3.0%, CPC: $0.30-1.50
+- Use trending sounds and effects
+    """
+})
+
+
 class CampaignAgent:
     def __init__(self):
         self.model = genai.GenerativeModel('gemini-2.0-flash')
@@ -71,15 +129,8 @@ Return ONLY valid JSON, no markdown, no explanations."""
             # Generate with Gemini
             response = self.model.generate_content(prompt)
             
-            # Clean response (remove markdown if present)
-            text = response.text.strip()
-            if text.startswith('```json'):
-                text = text.split('```json')[1].split('```')[0].strip()
-            elif text.startswith('```'):
-                text = text.split('```')[1].split('```')[0].strip()
-            
-            # Parse JSON
-            strategy = json.loads(text)
+            # Parse JSON (remove markdown if present)
+            strategy = _parse_json_response(response.text.strip())
             
             # Save to database
             result = supabase.table('campaign_plans').insert({
@@ -116,37 +167,4 @@ Return ONLY valid JSON, no markdown, no explanations."""
     
     def _get_platform_knowledge(self, platform):
         """Get platform-specific best practices"""
-        knowledge = {
-            'linkedin': """
-LinkedIn Best Practices:
-- B2B focus, professional tone essential
-- Carousel ads: 2x engagement vs single image
-- Targeting: Job titles, company size, industry
-- Lead gen forms reduce friction
-- Optimal times: Tue-Thu, 9-11am
-- Image specs: 1200x627px (1.91:1 ratio)
-- Character limits: Headline 70, Body 150
-- Typical CTR: 0.5-1.0%, CPC: $5-15, CPL: $50-150
-            """,
-            'meta': """
-Meta (Facebook/Instagram) Best Practices:
-- Stories and Reels: highest engagement
-- Interest-based + lookalike targeting
-- Retargeting essential for conversions
-- Image ratio: 1:1 or 4:5 for feed, 9:16 for stories
-- Character limits: Headline 40, Body 125
-- Typical CTR: 0.9-2.5%, CPC: $0.50-3.00
-- Test multiple ad variations
-            """,
-            'tiktok': """
-TikTok Best Practices:
-- Short vertical video (15-30 sec)
-- Authentic, raw content beats polished
-- Hook in first 3 seconds critical
-- 9:16 aspect ratio required
-- Gen Z and Millennial audience
-- Typical CTR: 1.5-3.0%, CPC: $0.30-1.50
-- Use trending sounds and effects
-            """
-        }
-        return knowledge.get(platform, "No platform knowledge available")
\ No newline at end of file
+        return _PLATFORM_KNOWLEDGE.get(platform, "No platform knowledge available")
\ No newline at end of file
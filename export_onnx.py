@@ -0,0 +1,42 @@
+"""
+One-time export of all-MiniLM-L6-v2 to ONNX for CPU inference
+Runs optimum's O3 graph optimizations, then int8 dynamic quantization
+
+Usage: python export_onnx.py
+"""
+
+import subprocess
+from pathlib import Path
+
+from onnxruntime.quantization import QuantType, quantize_dynamic
+
+from brand_rag import ONNX_MODEL_DIR, ONNX_MODEL_FILE
+
+MODEL_ID = "sentence-transformers/all-MiniLM-L6-v2"
+
+
+def export_model(output_dir: Path = ONNX_MODEL_DIR):
+    """Export, optimize and quantize the embeddings model into output_dir"""
+    print(f"📦 Exporting {MODEL_ID} to ONNX...")
+    subprocess.run(
+        [
+            "optimum-cli", "export", "onnx",
+            "--model", MODEL_ID,
+            "--task", "feature-extraction",
+            "--optimize", "O3",
+            str(output_dir)
+        ],
+        check=True
+    )
+    
+    print("🔢 Applying int8 dynamic quantization...")
+    quantize_dynamic(
+        model_input=str(output_dir / "model.onnx"),
+        model_output=str(output_dir / ONNX_MODEL_FILE),
+        weight_type=QuantType.QInt8
+    )
+    print(f"✅ Quantized model written to {output_dir / ONNX_MODEL_FILE}")
+
+
+if __name__ == "__main__":
+    export_model()
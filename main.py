@@ -1,5 +1,6 @@
 import streamlit as st
 import sys
+import threading
 from pathlib import Path
 
 # Add current directory to path
@@ -8,6 +9,92 @@ sys.path.insert(0, str(Path(__file__).parent))
 from campaign_agent import CampaignAgent
 from brand_rag import BrandRAG
 
+# Strips NUL bytes (rejected by Postgres) and pdfium's CR from CRLF line breaks
+_STRIP = str.maketrans('', '', '\x00\r')
+
+@st.cache_resource
+def _pdfium_lock():
+    """
+    Process-wide lock for all pdfium calls
+    PDFium is not thread-safe, even across documents, and every Streamlit session
+    runs in its own thread (cached because this script re-runs on every interaction)
+    """
+    return threading.Lock()
+
+def _extract_pdf_pages(data: bytes):
+    """
+    Open a PDF and return an iterator over its page texts
+    Every pdfium call (open and close included) holds the process-wide lock
+    """
+    import pypdfium2 as pdfium
+    
+    # Resolve the cached lock here, in the script thread, not in a pipeline worker
+    lock = _pdfium_lock()
+    with lock:
+        pdf = pdfium.PdfDocument(data)
+        n_pages = len(pdf)
+    
+    def pages():
+        try:
+            for idx in range(n_pages):
+                with lock:
+                    page = pdf[idx]
+                    try:
+                        textpage = page.get_textpage()
+                        try:
+                            text = textpage.get_text_range()
+                        finally:
+                            textpage.close()
+                    finally:
+                        page.close()
+                # Yield outside the lock so other sessions can parse meanwhile
+                yield text
+        finally:
+            with lock:
+                pdf.close()
+    
+    return pages()
+
+def _iter_pdf_chunks(pages, max_chars: int = 500):
+    """
+    Yield ~max_chars chunks of paragraphs page by page
+    A paragraph split across pages is carried over, matching a whole-document split
+    """
+    buf: list[str] = []
+    buf_len = 0
+    tail = ""
+    
+    def merge(paragraphs):
+        """Merge paragraphs into chunks (list buffer + join keeps this linear)"""
+        nonlocal buf, buf_len
+        for para in paragraphs:
+            para = para.strip()
+            if not para:
+                continue
+            
+            if buf_len + len(para) < max_chars:
+                buf.append(para)
+                buf.append("\n\n")
+                buf_len += len(para) + 2
+            else:
+                if buf:
+                    yield "".join(buf).strip()
+                buf = [para, "\n\n"]
+                buf_len = len(para) + 2
+    
+    for text in pages:
+        if not text:
+            continue
+        
+        # Sanitize each page once, then keep the last (possibly partial) paragraph
+        text = text.translate(_STRIP)
+        *paragraphs, tail = (tail + "\n" + text if tail else text).split('\n\n')
+        yield from merge(paragraphs)
+    
+    yield from merge([tail])
+    if buf:
+        yield "".join(buf).strip()
+
 st.set_page_config(
     page_title="Campaign Performance Agent",
     page_icon="📊",
@@ -15,21 +102,35 @@ st.set_page_config(
     initial_sidebar_state="collapsed"
 )
 
+@st.cache_resource
+def _load_rag():
+    """Load the RAG system (embeddings model + Supabase) once per process"""
+    return BrandRAG()
+
+def get_rag():
+    """Shared BrandRAG; failed setups are retried instead of staying cached"""
+    rag = _load_rag()
+    if rag.embedder is None:
+        # Retry the model download on the next rerun
+        _load_rag.clear()
+    elif rag.db is None:
+        # Keep the loaded model; only retry the Supabase connection
+        rag.connect_db()
+    return rag
+
+@st.cache_resource
+def get_agent():
+    """Create the Gemini campaign agent once per process"""
+    return CampaignAgent()
+
 # Custom CSS for landing page
-st.markdown("""
-<style>
-    .main-header {
-        text-align: center;
-        padding: 2rem 0;
-    }
-    .feature-box {
-        background: #f0f2f6;
-        padding: 1.5rem;
-        border-radius: 10px;
-        margin: 1rem 0;
-    }
-</style>
-""", unsafe_allow_html=True)
+@st.cache_data(ttl=None)
+def _css() -> str:
+    """Read the landing page stylesheet once per process"""
+    css = (Path(__file__).parent / "static" / "style.css").read_text()
+    return f"<style>\n{css}</style>"
+
+st.markdown(_css(), unsafe_allow_html=True)
 
 # Hero Section
 st.markdown("<h1 class='main-header'>📊 Campaign Performance Agent</h1>", unsafe_allow_html=True)
@@ -83,14 +184,14 @@ with col1:
         else:
             with st.spinner("🤖 AI Agent analyzing... (10-15 seconds)"):
                 try:
-                    agent = CampaignAgent()
+                    agent = get_agent()
                     
                     # Get brand context if available
                     org_id = st.session_state.get('org_id', None)
                     brand_context = []
                     
                     if org_id:
-                        rag = BrandRAG()
+                        rag = get_rag()
                         brand_context = rag.retrieve_brand_context(
                             brand_id=org_id,
                             query=goal,
@@ -119,7 +220,7 @@ with col1:
                 except Exception as e:
                     st.error(f"❌ Error: {str(e)}")
                     # Fallback
-                    agent = CampaignAgent()
+                    agent = get_agent()
                     recommendations = agent._get_fallback_recommendations(goal, budget, duration)
                     st.session_state.recommendations = recommendations
 
@@ -140,58 +241,23 @@ with col2:
             if st.button("🚀 Process Documents", use_container_width=True):
                 with st.spinner("Processing..."):
                     try:
-                        import io
-                        from PyPDF2 import PdfReader
-                        
-                        rag = BrandRAG()
+                        rag = get_rag()
                         org_id = st.session_state.get('org_id', None)
                         
                         total_chunks = 0
                         
                         for uploaded_file in uploaded_docs:
-                            pdf_reader = PdfReader(io.BytesIO(uploaded_file.read()))
-                            
-                            full_text = ""
-                            for page in pdf_reader.pages:
-                                text = page.extract_text()
-                                if text:
-                                    text = text.replace('\x00', '').replace('\u0000', '')
-                                    full_text += text + "\n"
-                            
-                            # Chunk text
-                            chunks = []
-                            paragraphs = full_text.split('\n\n')
-                            current_chunk = ""
-                            
-                            for para in paragraphs:
-                                para = para.strip()
-                                if not para:
-                                    continue
-                                
-                                if len(current_chunk) + len(para) < 500:
-                                    current_chunk += para + "\n\n"
-                                else:
-                                    if current_chunk.strip():
-                                        clean = current_chunk.strip().replace('\x00', '')
-                                        if clean:
-                                            chunks.append(clean)
-                                    current_chunk = para + "\n\n"
-                            
-                            if current_chunk.strip():
-                                clean = current_chunk.strip().replace('\x00', '')
-                                if clean:
-                                    chunks.append(clean)
+                            # Parse, embed and upload concurrently (raises on failure)
+                            stored = rag.store_brand_stream(
+                                brand_id=org_id,
+                                chunks=_iter_pdf_chunks(_extract_pdf_pages(uploaded_file.read())),
+                                content_type='brand_knowledge',
+                                source=uploaded_file.name
+                            )
                             
-                            if chunks:
-                                success = rag.store_brand_examples(
-                                    brand_id=org_id,
-                                    examples=chunks,
-                                    content_type='brand_knowledge',
-                                    source=uploaded_file.name
-                                )
-                                
-                                if success:
-                                    total_chunks += len(chunks)
+                            if stored == 0:
+                                st.info(f"ℹ️ No new content in {uploaded_file.name} (empty, too short, or already uploaded)")
+                            total_chunks += stored
                         
                         if total_chunks > 0:
                             st.success(f"✅ Stored {total_chunks} chunks!")
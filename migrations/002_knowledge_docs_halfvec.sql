@@ -0,0 +1,62 @@
+-- Store embeddings as halfvec(384) (FP16) instead of vector(384) (FP32)
+-- Halves row size and memory traffic during HNSW traversal
+-- Requires pgvector >= 0.8.0 (halfvec + iterative index scans)
+
+DROP INDEX IF EXISTS idx_knowledge_embedding_hnsw;
+
+ALTER TABLE knowledge_docs
+    ALTER COLUMN embedding TYPE halfvec(384)
+    USING embedding::halfvec(384);
+
+SET maintenance_work_mem = '2GB';
+SET max_parallel_maintenance_workers = 7;
+
+CREATE INDEX IF NOT EXISTS idx_knowledge_embedding_hnsw
+    ON knowledge_docs
+    USING hnsw (embedding halfvec_cosine_ops)
+    WITH (m = 24, ef_construction = 128);
+
+RESET maintenance_work_mem;
+RESET max_parallel_maintenance_workers;
+
+-- Signature changes, so drop the vector(384) version first
+DROP FUNCTION IF EXISTS match_knowledge_docs(vector, text, float, int);
+
+CREATE OR REPLACE FUNCTION match_knowledge_docs(
+    query_embedding halfvec(384),
+    match_org_id text,
+    match_threshold float,
+    match_count int
+)
+RETURNS TABLE (
+    id bigint,
+    content text,
+    org_id text,
+    metadata jsonb,
+    similarity float
+)
+LANGUAGE sql STABLE
+SET hnsw.ef_search = 100
+-- org_id is applied after the HNSW scan; without iterative scans at most
+-- ef_search candidates reach the filter and per-org recall collapses
+SET hnsw.iterative_scan = 'relaxed_order'
+AS $$
+    -- Only org_id filters the index scan; the threshold is applied afterwards so
+    -- iterative scans stop at match_count rows instead of walking to max_scan_tuples
+    -- relaxed_order may emit rows slightly out of order, so re-sort them
+    WITH matches AS MATERIALIZED (
+        SELECT
+            kd.id,
+            kd.content,
+            kd.org_id,
+            kd.metadata,
+            1 - (kd.embedding <=> query_embedding) AS similarity
+        FROM knowledge_docs kd
+        WHERE kd.org_id IS NOT DISTINCT FROM match_org_id
+        ORDER BY kd.embedding <=> query_embedding
+        LIMIT match_count
+    )
+    SELECT * FROM matches
+    WHERE similarity > match_threshold
+    ORDER BY similarity DESC;
+$$;
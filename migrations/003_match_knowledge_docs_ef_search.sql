@@ -0,0 +1,49 @@
+-- Let the caller pick hnsw.ef_search per query
+-- A separate SET LOCAL RPC would run in its own transaction, so the
+-- setting is applied inside match_knowledge_docs itself
+
+DROP FUNCTION IF EXISTS match_knowledge_docs(halfvec, text, float, int);
+
+CREATE OR REPLACE FUNCTION match_knowledge_docs(
+    query_embedding halfvec(384),
+    match_org_id text,
+    match_threshold float,
+    match_count int,
+    match_ef_search int DEFAULT 100
+)
+RETURNS TABLE (
+    id bigint,
+    content text,
+    org_id text,
+    metadata jsonb,
+    similarity float
+)
+LANGUAGE plpgsql STABLE
+AS $$
+BEGIN
+    -- Equivalent to SET LOCAL: reverts at the end of the transaction
+    PERFORM set_config('hnsw.ef_search', match_ef_search::text, true);
+    -- Keep scanning the index until enough rows pass the org_id filter
+    PERFORM set_config('hnsw.iterative_scan', 'relaxed_order', true);
+
+    -- Only org_id filters the index scan; the threshold is applied afterwards so
+    -- iterative scans stop at match_count rows instead of walking to max_scan_tuples
+    -- relaxed_order may emit rows slightly out of order, so re-sort them
+    RETURN QUERY
+    WITH matches AS MATERIALIZED (
+        SELECT
+            kd.id,
+            kd.content,
+            kd.org_id,
+            kd.metadata,
+            (1 - (kd.embedding <=> query_embedding))::float AS similarity
+        FROM knowledge_docs kd
+        WHERE kd.org_id IS NOT DISTINCT FROM match_org_id
+        ORDER BY kd.embedding <=> query_embedding
+        LIMIT match_count
+    )
+    SELECT * FROM matches m
+    WHERE m.similarity > match_threshold
+    ORDER BY m.similarity DESC;
+END;
+$$;
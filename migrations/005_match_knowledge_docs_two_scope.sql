@@ -0,0 +1,70 @@
+-- Brand + platform knowledge search in a single RPC round trip
+-- Brand hits come first; platform hits fill the remaining slots
+
+CREATE OR REPLACE FUNCTION match_knowledge_docs_two_scope(
+    query_embedding halfvec(384),
+    brand_org_id text,
+    match_threshold float,
+    match_count int,
+    include_platform boolean DEFAULT true,
+    match_ef_search int DEFAULT 100
+)
+RETURNS TABLE (
+    id bigint,
+    content text,
+    org_id text,
+    metadata jsonb,
+    similarity float,
+    scope text
+)
+LANGUAGE plpgsql STABLE
+AS $$
+BEGIN
+    -- Equivalent to SET LOCAL: reverts at the end of the transaction
+    PERFORM set_config('hnsw.ef_search', match_ef_search::text, true);
+    -- Each branch filters by org_id after the HNSW scan; keep scanning until
+    -- enough rows pass so platform rows can't crowd out the brand's
+    PERFORM set_config('hnsw.iterative_scan', 'relaxed_order', true);
+
+    -- Each branch only filters by org_id inside its materialized CTE; the threshold
+    -- is applied afterwards so iterative scans stop at match_count rows per scope
+    -- relaxed_order may emit rows slightly out of order; the final ORDER BY re-sorts
+    RETURN QUERY
+    WITH brand_matches AS MATERIALIZED (
+        SELECT
+            kd.id,
+            kd.content,
+            kd.org_id,
+            kd.metadata,
+            (-(kd.embedding <#> query_embedding))::float AS similarity,
+            'brand'::text AS scope
+        FROM knowledge_docs kd
+        WHERE kd.org_id = brand_org_id
+        ORDER BY kd.embedding <#> query_embedding
+        LIMIT match_count
+    ),
+    platform_matches AS MATERIALIZED (
+        SELECT
+            kd.id,
+            kd.content,
+            kd.org_id,
+            kd.metadata,
+            (-(kd.embedding <#> query_embedding))::float AS similarity,
+            'platform'::text AS scope
+        FROM knowledge_docs kd
+        WHERE include_platform
+          AND kd.org_id IS NULL
+        ORDER BY kd.embedding <#> query_embedding
+        LIMIT match_count
+    )
+    SELECT r.id, r.content, r.org_id, r.metadata, r.similarity, r.scope
+    FROM (
+        SELECT * FROM brand_matches
+        UNION ALL
+        SELECT * FROM platform_matches
+    ) r
+    WHERE r.similarity > match_threshold
+    ORDER BY (r.scope = 'platform'), r.similarity DESC
+    LIMIT match_count;
+END;
+$$;
@@ -0,0 +1,79 @@
+-- O(1) chunk counts instead of SELECT count(*) over knowledge_docs
+-- Per-org counters are maintained by statement-level triggers;
+-- platform knowledge (org_id IS NULL) is stored under org_key = ''
+
+CREATE TABLE IF NOT EXISTS knowledge_doc_counts (
+    org_key text PRIMARY KEY,
+    n bigint NOT NULL DEFAULT 0
+);
+
+-- No policies: anon/authenticated can't touch the counters through PostgREST;
+-- the SECURITY DEFINER trigger and count functions below still can
+ALTER TABLE knowledge_doc_counts ENABLE ROW LEVEL SECURITY;
+
+CREATE OR REPLACE FUNCTION knowledge_doc_counts_on_insert()
+RETURNS trigger
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+    INSERT INTO knowledge_doc_counts (org_key, n)
+    SELECT coalesce(org_id, ''), count(*) FROM new_rows GROUP BY 1
+    ON CONFLICT (org_key) DO UPDATE SET n = knowledge_doc_counts.n + EXCLUDED.n;
+    RETURN NULL;
+END;
+$$;
+
+CREATE OR REPLACE FUNCTION knowledge_doc_counts_on_delete()
+RETURNS trigger
+LANGUAGE plpgsql
+SECURITY DEFINER
+SET search_path = public
+AS $$
+BEGIN
+    UPDATE knowledge_doc_counts c
+    SET n = c.n - d.n
+    FROM (SELECT coalesce(org_id, '') AS org_key, count(*) AS n FROM old_rows GROUP BY 1) d
+    WHERE c.org_key = d.org_key;
+    RETURN NULL;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trg_knowledge_doc_counts_insert ON knowledge_docs;
+CREATE TRIGGER trg_knowledge_doc_counts_insert
+    AFTER INSERT ON knowledge_docs
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION knowledge_doc_counts_on_insert();
+
+DROP TRIGGER IF EXISTS trg_knowledge_doc_counts_delete ON knowledge_docs;
+CREATE TRIGGER trg_knowledge_doc_counts_delete
+    AFTER DELETE ON knowledge_docs
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION knowledge_doc_counts_on_delete();
+
+-- Backfill from the existing rows
+INSERT INTO knowledge_doc_counts (org_key, n)
+SELECT coalesce(org_id, ''), count(*) FROM knowledge_docs GROUP BY 1
+ON CONFLICT (org_key) DO UPDATE SET n = EXCLUDED.n;
+
+-- Chunk count for one org (NULL = platform knowledge)
+CREATE OR REPLACE FUNCTION count_knowledge_chunks_fast(match_org_id text)
+RETURNS bigint
+LANGUAGE sql STABLE
+SECURITY DEFINER
+SET search_path = public
+AS $$
+    SELECT coalesce(
+        (SELECT n FROM knowledge_doc_counts WHERE org_key = coalesce(match_org_id, '')),
+        0
+    );
+$$;
+
+-- Planner estimate of the whole table size (good enough for ef_search tuning)
+CREATE OR REPLACE FUNCTION estimate_knowledge_docs_total()
+RETURNS bigint
+LANGUAGE sql STABLE
+AS $$
+    SELECT greatest(reltuples, 0)::bigint FROM pg_class WHERE relname = 'knowledge_docs';
+$$;
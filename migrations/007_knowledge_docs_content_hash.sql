@@ -0,0 +1,4 @@
+-- Lookup of already-stored chunks by content hash (BrandRAG skips re-uploads)
+
+CREATE INDEX IF NOT EXISTS idx_knowledge_docs_content_hash
+    ON knowledge_docs (org_id, (metadata->>'content_hash'));
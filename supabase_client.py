@@ -7,6 +7,10 @@ from supabase import create_client, Client
 import streamlit as st
 from typing import Optional, Dict, List, Any
 import os
+import time
+
+# How long the cached corpus size is trusted before re-reading the estimate
+CHUNK_COUNT_TTL_SECONDS = 60
 
 class SupabaseManager:
     """Manages Supabase connection and operations"""
@@ -14,6 +18,11 @@ class SupabaseManager:
     def __init__(self):
         """Initialize Supabase client"""
         self.client: Optional[Client] = None
+        
+        # Cached corpus size used to tune hnsw.ef_search
+        self._chunk_count: Optional[int] = None
+        self._chunk_count_at = 0.0
+        
         self._initialize_client()
     
     def _initialize_client(self):
@@ -81,6 +90,57 @@ class SupabaseManager:
         except Exception as e:
             return {"success": False, "error": str(e)}
     
+    def store_knowledge_chunks_bulk(self, rows: List[Dict]) -> Dict:
+        """Store many knowledge chunks in a single insert round trip"""
+        if not self.is_connected():
+            return {"success": False, "error": "Not connected to Supabase"}
+        
+        try:
+            data = [
+                {
+                    "content": row["content"],
+                    "embedding": row["embedding"],
+                    "org_id": row.get("org_id"),
+                    "doc_type": "knowledge_chunk",
+                    "metadata": row.get("metadata") or {}
+                }
+                for row in rows
+            ]
+            
+            result = self.client.table("knowledge_docs").insert(data).execute()
+            
+            if result.data:
+                return {"success": True, "ids": [r["id"] for r in result.data]}
+            else:
+                return {"success": False, "error": "No data returned"}
+                
+        except Exception as e:
+            return {"success": False, "error": str(e)}
+    
+    def existing_content_hashes(self, org_id: Optional[str], hashes: List[str]) -> set:
+        """Return which of the given content hashes are already stored for org_id"""
+        if not self.is_connected() or not hashes:
+            return set()
+        
+        try:
+            query = (
+                self.client.table("knowledge_docs")
+                .select("content_hash:metadata->>content_hash")
+                .in_("metadata->>content_hash", hashes)
+            )
+            
+            if org_id is None:
+                query = query.is_("org_id", "null")
+            else:
+                query = query.eq("org_id", org_id)
+            
+            result = query.execute()
+            return {r["content_hash"] for r in result.data or []}
+            
+        except Exception as e:
+            print(f"⚠️ Content hash lookup failed: {e}")
+            return set()
+    
     def semantic_search(
         self, 
         query_embedding: List[float], 
@@ -100,7 +160,8 @@ class SupabaseManager:
                     'query_embedding': query_embedding,
                     'match_org_id': org_id,
                     'match_threshold': threshold,
-                    'match_count': limit
+                    'match_count': limit,
+                    'match_ef_search': self._ef_search_for_scale(self._cached_chunk_count())
                 }
             ).execute()
             
@@ -113,6 +174,73 @@ class SupabaseManager:
             print(f"❌ Semantic search failed: {e}")
             return []
     
+    def semantic_search_two_scope(
+        self, 
+        query_embedding: List[float], 
+        org_id: Optional[str] = None,
+        limit: int = 5,
+        threshold: float = 0.7,
+        include_platform: bool = True
+    ) -> List[Dict]:
+        """Search brand and platform knowledge in one RPC (brand results first)"""
+        if not self.is_connected():
+            print("❌ Not connected to Supabase")
+            return []
+        
+        try:
+            result = self.client.rpc(
+                'match_knowledge_docs_two_scope',
+                {
+                    'query_embedding': query_embedding,
+                    'brand_org_id': org_id,
+                    'match_threshold': threshold,
+                    'match_count': limit,
+                    'include_platform': include_platform,
+                    'match_ef_search': self._ef_search_for_scale(self._cached_chunk_count())
+                }
+            ).execute()
+            
+            if result.data:
+                return result.data
+            else:
+                return []
+                
+        except Exception as e:
+            print(f"❌ Semantic search failed: {e}")
+            return []
+    
+    @staticmethod
+    def _ef_search_for_scale(n: int) -> int:
+        """
+        HNSW ef_search for a corpus of n chunks (higher = better recall, slower)
+        Never below pgvector's default of 100: searches are filtered by org_id
+        """
+        if n < 1_000_000:
+            return 100
+        return 200
+    
+    def _cached_chunk_count(self) -> int:
+        """
+        Estimated total chunk count, re-read after the TTL
+        pg_class.reltuples only changes on ANALYZE/VACUUM, so refreshing it
+        after our own inserts would just return the same value
+        """
+        stale = (
+            self._chunk_count is None
+            or time.monotonic() - self._chunk_count_at > CHUNK_COUNT_TTL_SECONDS
+        )
+        
+        if stale:
+            try:
+                result = self.client.rpc('estimate_knowledge_docs_total', {}).execute()
+                self._chunk_count = result.data or 0
+            except Exception as e:
+                print(f"⚠️ Chunk count refresh failed: {e}")
+                self._chunk_count = self._chunk_count or 0
+            self._chunk_count_at = time.monotonic()
+        
+        return self._chunk_count
+    
     def count_knowledge_chunks(self, org_id: Optional[str] = None) -> int:
         """Count total knowledge chunks"""
         if not self.is_connected():
@@ -133,6 +261,22 @@ class SupabaseManager:
             print(f"❌ Count failed: {e}")
             return 0
     
+    def count_knowledge_chunks_fast(self, org_id: Optional[str] = None) -> int:
+        """Count knowledge chunks from the trigger-maintained counter table"""
+        if not self.is_connected():
+            return 0
+        
+        try:
+            result = self.client.rpc(
+                'count_knowledge_chunks_fast',
+                {'match_org_id': org_id}
+            ).execute()
+            return result.data or 0
+            
+        except Exception as e:
+            print(f"⚠️ Fast count failed ({e}), falling back to exact count")
+            return self.count_knowledge_chunks(org_id=org_id)
+    
     def test_connection(self) -> Dict:
         """Test database connectivity"""
         if not self.is_connected():
@@ -147,4 +291,19 @@ class SupabaseManager:
                 "has_data": len(result.data) > 0 if result.data else False
             }
         except Exception as e:
-            return {"success": False, "error": str(e)}
\ No newline at end of file
+            return {"success": False, "error": str(e)}
+
+
+@st.cache_resource
+def _load_supabase_manager() -> SupabaseManager:
+    """Create the SupabaseManager once per process"""
+    return SupabaseManager()
+
+
+def get_supabase_manager() -> SupabaseManager:
+    """Shared SupabaseManager so the HTTP session is reused across reruns"""
+    manager = _load_supabase_manager()
+    if not manager.is_connected():
+        # Don't keep a failed client around; retry on the next call
+        _load_supabase_manager.clear()
+    return manager